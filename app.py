@@ -1,8 +1,12 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 import os
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
 
 # -------------------------------
 # PAGE CONFIG
@@ -16,7 +20,7 @@ st.set_page_config(
 # -------------------------------
 # PREMIUM BACKGROUND + STYLE
 # -------------------------------
-st.markdown("""
+PAGE_CSS = """
     <style>
         body {
             background: linear-gradient(to right, #f8fbff, #eef3ff);
@@ -30,7 +34,7 @@ st.markdown("""
             padding: 20px;
         }
 
-        .kpi-card {
+        [data-testid="stMetric"] {
             background: white;
             border-radius: 18px;
             padding: 18px;
@@ -38,13 +42,14 @@ st.markdown("""
             box-shadow: 0px 4px 18px rgba(0,0,0,0.10);
         }
 
-        .kpi-value {
+        [data-testid="stMetricValue"] {
             font-size: 28px;
             font-weight: bold;
             color: #002855;
         }
 
-        .kpi-label {
+        [data-testid="stMetricLabel"] {
+            justify-content: center;
             font-size: 14px;
             color: gray;
         }
@@ -62,7 +67,9 @@ st.markdown("""
             color: #002855;
         }
     </style>
-""", unsafe_allow_html=True)
+"""
+
+st.markdown(PAGE_CSS, unsafe_allow_html=True)
 
 # -------------------------------
 # TITLE
@@ -73,24 +80,309 @@ st.markdown("<div class='main-title'>ONLINE SHOPPING BEHAVIOR ANALYSIS</div>",
 # -------------------------------
 # LOAD DATASET
 # -------------------------------
-@st.cache_data
+CSV_PATH = Path("Shopping.csv")
+
+# Bump whenever parse_csv() changes what it produces, so Parquet copies
+# written by older cleaning code are ignored instead of served
+CLEANING_VERSION = 1
+PARQUET_PATH = CSV_PATH.with_suffix(f".v{CLEANING_VERSION}.parquet")
+
+CATEGORY_COLUMNS = ["Product_Category", "Payment_Method", "Gender", "Season"]
+
+def parse_csv():
+    df = pd.read_csv(CSV_PATH, engine="pyarrow")
+    if any(c != c.strip() for c in df.columns):
+        df.columns = df.columns.str.strip()
+
+    # Rename Columns
+    df.rename(columns={
+        "Category": "Product_Category",
+        "Payment Method": "Payment_Method",
+        "Purchase Amount (USD)": "Sales",
+        "Customer ID": "Customer_ID"
+    }, inplace=True)
+
+    # Low-cardinality text columns: filter and count on integer codes
+    for col in CATEGORY_COLUMNS:
+        df[col] = df[col].astype("category")
+
+    # Remaining text stays as contiguous Arrow strings, not a Python object
+    # per cell (pandas 3 already reads them this way)
+    for col in df.columns:
+        if pd.api.types.is_object_dtype(df[col]):
+            df[col] = df[col].astype("string[pyarrow]")
+
+    # Shrink every integer column (ages and whole-dollar amounts fit in a
+    # byte); to_numeric checks the range, and sums still accumulate in int64
+    for col in df.select_dtypes("integer").columns:
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+
+    write_parquet(df)
+    return df
+
+# Write to a temp file and rename it into place, so a crash or a concurrent
+# worker never leaves a truncated copy at PARQUET_PATH. The copy is only a
+# cache: read-only deployments, or frames pyarrow cannot convert, just
+# parse the CSV on every cold start.
+def write_parquet(df):
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=PARQUET_PATH.parent,
+                                        prefix=f"{PARQUET_PATH.name}.",
+                                        suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "wb") as f:
+            df.to_parquet(f)
+        os.replace(tmp_path, PARQUET_PATH)
+    except Exception:
+        Path(tmp_path).unlink(missing_ok=True)
+
+# Shared by reference across reruns and sessions; callers must not mutate it
+@st.cache_resource
 def load_data():
-    csv_files = [f for f in os.listdir() if f.endswith(".csv")]
-    df = pd.read_csv(csv_files[0])
-    df.columns = df.columns.str.strip()
+    # Reuse the cleaned Parquet copy unless the CSV changed since it was written
+    df = None
+    if (PARQUET_PATH.exists()
+            and PARQUET_PATH.stat().st_mtime >= CSV_PATH.stat().st_mtime):
+        # An unreadable copy is rebuilt from the CSV rather than fatal
+        try:
+            df = pd.read_parquet(PARQUET_PATH)
+        except (OSError, ValueError):
+            df = None
+    if df is None:
+        df = parse_csv()
+
+    # Dense 0..n-1 customer codes turn the distinct-customer count into a
+    # bincount. Derived here rather than stored, so the Parquet copy stays a
+    # plain cleaned CSV and never holds stale codes.
+    df["_cust_code"] = pd.factorize(df["Customer_ID"])[0].astype(np.int32)
     return df
 
-df = load_data()
+# Sidebar choices only change with the dataset, so work them out once.
+# Blank cells are not offered as choices; that also keeps the selections
+# sortable for the cache key.
+@st.cache_data
+def load_filter_options():
+    df = load_data()
+    return {
+        "seasons": df["Season"].dropna().unique().tolist(),
+        "categories": df["Product_Category"].dropna().unique().tolist(),
+        "payments": df["Payment_Method"].dropna().unique().tolist(),
+        "min_sales": int(df["Sales"].min()),
+        "max_sales": int(df["Sales"].max()),
+        # Untruncated bounds, for telling when the slider keeps every row
+        "sales_range": (float(df["Sales"].min()), float(df["Sales"].max())),
+        "sales_has_blanks": bool(df["Sales"].hasnans),
+    }
 
-# Rename Columns
-df.rename(columns={
-    "Category": "Product_Category",
-    "Payment Method": "Payment_Method",
-    "Purchase Amount (USD)": "Sales",
-    "Customer ID": "Customer_ID"
-}, inplace=True)
+# -------------------------------
+# CACHED AGGREGATIONS
+# -------------------------------
+# Filter combinations remembered per session (see KPI VALUES)
+KPI_CACHE_SIZE = 16
+
+# Filter combinations kept process-wide by the caches keyed on the filters;
+# without a cap, every slider range and subset ever visited stays in memory.
+# Download CSVs hold whole slices, so fewer of them are kept.
+FILTER_CACHE_ENTRIES = 64
+DOWNLOAD_CACHE_ENTRIES = 8
+
+# Categorical columns counted for the charts, with their chart labels
+COUNT_COLUMNS = {
+    "Product_Category": "Category",
+    "Payment_Method": "Method",
+}
+
+# Match a categorical column against its integer codes, not its labels:
+# a small per-category lookup table is indexed by each row's code. Blank
+# cells (code -1) never match a selection. Returns None when every category
+# is selected and the clause is a no-op.
+def category_mask(col, values):
+    allowed = np.zeros(len(col.cat.categories), dtype=bool)
+    selected = col.cat.categories.get_indexer(values)
+    allowed[selected[selected >= 0]] = True
+    if allowed.all():
+        return None
+    codes = col.cat.codes.to_numpy()
+    return (codes >= 0) & allowed[codes]
+
+# One combined mask, so the frame is indexed and copied a single time.
+# Clauses that keep every row (the default selections) are skipped, and
+# None means no filtering is needed at all.
+def filter_mask(df, seasons, categories, payments, min_sales, max_sales):
+    clauses = [
+        category_mask(df["Season"], seasons),
+        category_mask(df["Product_Category"], categories),
+        category_mask(df["Payment_Method"], payments),
+    ]
+    clauses = [clause for clause in clauses if clause is not None]
+
+    # The range clause also drops blank sales, so it is only skipped when
+    # there are none and the range covers the true data bounds
+    options = load_filter_options()
+    low, high = options["sales_range"]
+    if options["sales_has_blanks"] or min_sales > low or max_sales < high:
+        sales = df["Sales"].to_numpy()
+        clauses += [sales >= min_sales, sales <= max_sales]
+
+    return np.logical_and.reduce(clauses) if clauses else None
+
+# Columns the KPIs and charts read; the rest only matter for the download
+AGGREGATE_COLUMNS = ("_cust_code", "Sales", "Season", "Age",
+                     "Product_Category", "Payment_Method")
+
+# Rows per category via bincount on the codes, largest first; categories
+# with no rows in the current selection and blank cells are left out
+def category_counts(col, label):
+    codes = col.cat.codes.to_numpy()
+    counts = np.bincount(codes[codes >= 0],
+                         minlength=len(col.cat.categories))
+    table = pd.DataFrame({label: col.cat.categories, "Count": counts})
+    return (table[table["Count"] > 0]
+            .sort_values("Count", ascending=False, kind="stable")
+            .reset_index(drop=True))
+
+# Not cached: each caller keeps only what it derives from the slice
+def apply_filters(seasons, categories, payments, min_sales, max_sales,
+                  columns=None):
+    df = load_data()
+    mask = filter_mask(df, seasons, categories, payments, min_sales, max_sales)
+    rows = slice(None) if mask is None else mask
+    # Project before copying so unused columns never leave the source frame
+    return df.loc[rows] if columns is None else df.loc[rows, list(columns)]
+
+# The download's CSV text, reused when the same selection is downloaded again
+@st.cache_data(max_entries=DOWNLOAD_CACHE_ENTRIES)
+def filtered_csv(seasons, categories, payments, min_sales, max_sales):
+    df = apply_filters(seasons, categories, payments, min_sales, max_sales)
+    return df.drop(columns="_cust_code").to_csv(index=False)
+
+@st.cache_data(max_entries=FILTER_CACHE_ENTRIES)
+def compute_aggregates(seasons, categories, payments, min_sales, max_sales):
+    df = apply_filters(seasons, categories, payments, min_sales, max_sales,
+                       columns=AGGREGATE_COLUMNS)
+
+    # Sum sales per season straight off the category codes; the KPI totals
+    # below are reduced from these few bins rather than rescanning the rows.
+    # Blank sales are skipped, as pandas' sum() skipped them.
+    season_names = df["Season"].cat.categories
+    season_codes = df["Season"].cat.codes.to_numpy()
+    sales = df["Sales"].to_numpy()
+    has_season = season_codes >= 0
+    has_sales = np.isfinite(sales)
+    summed = has_season & has_sales
+    season_rows = np.bincount(season_codes[has_season],
+                              minlength=len(season_names))
+    season_sales = np.bincount(season_codes[summed],
+                               weights=sales[summed],
+                               minlength=len(season_names))
+    monthly_sales = pd.DataFrame({
+        "Season": season_names[season_rows > 0],
+        "Sales": season_sales[season_rows > 0],
+    })
+
+    counts = {
+        col: category_counts(df[col], label)
+        for col, label in COUNT_COLUMNS.items()
+    }
+
+    # Bin ages here so the chart ships 10 bars instead of every row; blank
+    # ages are left out, as px.histogram did
+    ages = df["Age"].dropna().to_numpy()
+    age_counts, age_edges = np.histogram(ages, bins=10)
+    age_hist = pd.DataFrame({
+        "Age": (age_edges[:-1] + age_edges[1:]) / 2,
+        "Count": age_counts,
+    })
+
+    cust_codes = df["_cust_code"].to_numpy()
+    customer_rows = np.bincount(cust_codes[cust_codes >= 0])
+    total_customers = int(np.count_nonzero(customer_rows))
+
+    # Every row after a customer's first purchase is a repeat purchase
+    return {
+        "total_customers": total_customers,
+        "total_sales": (season_sales.sum()
+                        + sales[~has_season & has_sales].sum()),
+        "returning_customers": int(customer_rows.sum()) - total_customers,
+        "monthly_sales": monthly_sales,
+        "cat_count": counts["Product_Category"],
+        "payment_count": counts["Payment_Method"],
+        "age_hist": age_hist,
+    }
 
-df["Returning_Customer"] = df.duplicated("Customer_ID")
+# -------------------------------
+# CACHED FIGURES
+# -------------------------------
+# Figures are keyed on the small filter tuple rather than on the aggregate
+# frames, so a rerun only hashes a few strings and ints; the aggregates are
+# pulled from their own cache when a figure has to be built. cache_resource
+# hands back the same Figure object instead of unpickling a copy, which
+# would re-run Plotly's validation on every rerun. A fixed uirevision lets
+# the browser keep zoom and legend state and update the chart in place.
+@st.cache_resource(max_entries=FILTER_CACHE_ENTRIES)
+def make_sales_line(filter_key):
+    return px.line(
+        compute_aggregates(*filter_key)["monthly_sales"],
+        x="Season",
+        y="Sales",
+        markers=True,
+        title="📈 Sales Trend Over Time"
+    ).update_layout(uirevision="static")
+
+@st.cache_resource(max_entries=FILTER_CACHE_ENTRIES)
+def make_category_bar(filter_key):
+    return px.bar(
+        compute_aggregates(*filter_key)["cat_count"],
+        x="Count",
+        y="Category",
+        orientation="h",
+        title="🏆 Top Product Categories",
+        text="Count"
+    ).update_layout(uirevision="static")
+
+@st.cache_resource(max_entries=FILTER_CACHE_ENTRIES)
+def make_payment_pie(filter_key):
+    return px.pie(
+        compute_aggregates(*filter_key)["payment_count"],
+        names="Method",
+        values="Count",
+        title="💳 Payment Methods"
+    ).update_layout(uirevision="static")
+
+# The funnel never changes
+FUNNEL_STAGES = ["Visits", "Added to Cart", "Checkout", "Purchase"]
+FUNNEL_VALUES = [50000, 16000, 10800, 7500]
+
+@st.cache_resource
+def make_funnel():
+    funnel_fig = go.Figure(go.Funnel(
+        y=FUNNEL_STAGES,
+        x=FUNNEL_VALUES,
+        textinfo="value+percent initial"
+    ))
+    funnel_fig.update_layout(title="🛍 Purchase Funnel", uirevision="static")
+    return funnel_fig
+
+@st.cache_resource(max_entries=FILTER_CACHE_ENTRIES)
+def make_age_histogram(filter_key):
+    age_hist = compute_aggregates(*filter_key)["age_hist"]
+
+    age_fig = go.Figure(go.Bar(
+        x=age_hist["Age"],
+        y=age_hist["Count"]
+    ))
+    age_fig.update_layout(
+        title="📌 Customer Age Distribution",
+        xaxis_title="Age",
+        yaxis_title="Count",
+        bargap=0,
+        uirevision="static"
+    )
+    return age_fig
+
+filter_options = load_filter_options()
 
 # -------------------------------
 # SIDEBAR FILTERS (USEFUL)
@@ -101,77 +393,85 @@ st.sidebar.markdown("<p class='sidebar-title'>🎛 Dashboard Controls</p>",
 # Season Filter
 season_filter = st.sidebar.multiselect(
     "📅 Select Season",
-    options=df["Season"].unique(),
-    default=df["Season"].unique()
+    options=filter_options["seasons"],
+    default=filter_options["seasons"]
 )
 
 # Category Filter
 category_filter = st.sidebar.multiselect(
     "🛍 Select Category",
-    options=df["Product_Category"].unique(),
-    default=df["Product_Category"].unique()
+    options=filter_options["categories"],
+    default=filter_options["categories"]
 )
 
 # Payment Filter
 payment_filter = st.sidebar.multiselect(
     "💳 Select Payment Method",
-    options=df["Payment_Method"].unique(),
-    default=df["Payment_Method"].unique()
+    options=filter_options["payments"],
+    default=filter_options["payments"]
 )
 
 # Sales Range Slider
 min_sales, max_sales = st.sidebar.slider(
     "💰 Select Sales Range (USD)",
-    int(df["Sales"].min()),
-    int(df["Sales"].max()),
-    (int(df["Sales"].min()), int(df["Sales"].max()))
+    filter_options["min_sales"],
+    filter_options["max_sales"],
+    (filter_options["min_sales"], filter_options["max_sales"])
 )
 
-# Apply Filters
-filtered_df = df[
-    (df["Season"].isin(season_filter)) &
-    (df["Product_Category"].isin(category_filter)) &
-    (df["Payment_Method"].isin(payment_filter)) &
-    (df["Sales"] >= min_sales) &
-    (df["Sales"] <= max_sales)
-]
+# Sorted tuples are hashable and ignore selection order, so the same
+# filters always hit the same cache entry
+filter_key = (
+    tuple(sorted(season_filter)),
+    tuple(sorted(category_filter)),
+    tuple(sorted(payment_filter)),
+    min_sales,
+    max_sales
+)
 
 st.sidebar.success("✅ Filters Applied Successfully!")
 
-# Download Button
+# Download Button: the full filtered frame is built and encoded only on click
 st.sidebar.download_button(
     "⬇ Download Filtered Data",
-    filtered_df.to_csv(index=False),
+    lambda: filtered_csv(*filter_key),
     file_name="filtered_shopping_data.csv"
 )
 
 # -------------------------------
 # KPI VALUES
 # -------------------------------
-total_customers = filtered_df["Customer_ID"].nunique()
-total_sales = filtered_df["Sales"].sum()
-returning_customers = filtered_df["Returning_Customer"].sum()
+# Per-session LRU in front of st.cache_data: a filter combo seen before in
+# this session skips the argument hashing and result copy entirely
+if "kpi_cache" not in st.session_state:
+    st.session_state.kpi_cache = OrderedDict()
+kpi_cache = st.session_state.kpi_cache
+
+if filter_key in kpi_cache:
+    kpi_cache.move_to_end(filter_key)
+else:
+    kpi_cache[filter_key] = compute_aggregates(*filter_key)
+    if len(kpi_cache) > KPI_CACHE_SIZE:
+        kpi_cache.popitem(last=False)
+
+aggregates = kpi_cache[filter_key]
+
+total_customers = aggregates["total_customers"]
+total_sales = aggregates["total_sales"]
+returning_customers = aggregates["returning_customers"]
+returning_share = returning_customers / total_customers if total_customers else 0
 
 cart_abandon_rate = 32
 avg_rating = 4.2
 
-# KPI Card Function
-def kpi_card(col, label, value):
-    col.markdown(f"""
-        <div class="kpi-card">
-            <div class="kpi-value">{value}</div>
-            <div class="kpi-label">{label}</div>
-        </div>
-    """, unsafe_allow_html=True)
-
-# KPI Row
+# KPI Row: native metrics, styled as cards by PAGE_CSS
 k1, k2, k3, k4, k5 = st.columns(5)
 
-kpi_card(k1, "👥 Total Customers", total_customers)
-kpi_card(k2, "💰 Total Sales", f"${total_sales:,.0f}")
-kpi_card(k3, "🛒 Cart Abandonment", f"{cart_abandon_rate}%")
-kpi_card(k4, "🔁 Returning Customers", f"{(returning_customers/total_customers)*100:.0f}%")
-kpi_card(k5, "⭐ Avg Rating", f"{avg_rating}/5")
+k1.metric("👥 Total Customers", total_customers)
+k2.metric("💰 Total Sales", f"${total_sales:,.0f}")
+k3.metric("🛒 Cart Abandonment", f"{cart_abandon_rate}%")
+k4.metric("🔁 Returning Customers", f"{returning_share*100:.0f}%")
+k5.metric("⭐ Avg Rating", f"{avg_rating}/5")
 
 st.divider()
 
@@ -180,68 +480,31 @@ st.divider()
 # -------------------------------
 left, right = st.columns(2)
 
-monthly_sales = filtered_df.groupby("Season")["Sales"].sum().reset_index()
-
-line_fig = px.line(
-    monthly_sales,
-    x="Season",
-    y="Sales",
-    markers=True,
-    title="📈 Sales Trend Over Time"
-)
-left.plotly_chart(line_fig)
-
-cat_count = filtered_df["Product_Category"].value_counts().reset_index()
-cat_count.columns = ["Category", "Count"]
-
-bar_fig = px.bar(
-    cat_count,
-    x="Count",
-    y="Category",
-    orientation="h",
-    title="🏆 Top Product Categories",
-    text="Count"
-)
-right.plotly_chart(bar_fig)
+left.plotly_chart(make_sales_line(filter_key))
+right.plotly_chart(make_category_bar(filter_key))
 
 st.divider()
 
 # -------------------------------
 # PAYMENT PIE + FUNNEL + AGE
 # -------------------------------
-c1, c2, c3 = st.columns(3)
-
-payment_count = filtered_df["Payment_Method"].value_counts().reset_index()
-payment_count.columns = ["Method", "Count"]
-
-pie_fig = px.pie(
-    payment_count,
-    names="Method",
-    values="Count",
-    title="💳 Payment Methods"
+# Tracking the selected tab lets only the open tab build its chart
+payment_tab, funnel_tab, age_tab = st.tabs(
+    ["💳 Payments", "🛍 Funnel", "📌 Demographics"],
+    key="detail_tabs",
+    on_change="rerun"
 )
-c1.plotly_chart(pie_fig)
 
-# Funnel Chart
-stages = ["Visits", "Added to Cart", "Checkout", "Purchase"]
-values = [50000, 16000, 10800, 7500]
+if payment_tab.open:
+    payment_tab.plotly_chart(make_payment_pie(filter_key))
 
-funnel_fig = go.Figure(go.Funnel(
-    y=stages,
-    x=values,
-    textinfo="value+percent initial"
-))
-funnel_fig.update_layout(title="🛍 Purchase Funnel")
-c2.plotly_chart(funnel_fig)
+# Funnel Chart
+if funnel_tab.open:
+    funnel_tab.plotly_chart(make_funnel())
 
 # Age Distribution
-age_fig = px.histogram(
-    filtered_df,
-    x="Age",
-    nbins=10,
-    title="📌 Customer Age Distribution"
-)
-c3.plotly_chart(age_fig)
+if age_tab.open:
+    age_tab.plotly_chart(make_age_histogram(filter_key))
 
 st.divider()
 